@@ -26,6 +26,29 @@ logger = logging.getLogger(__name__)
 settings = get_settings()
 
 
+def build_user_profile_document(user_id: str, profile_data: dict) -> dict:
+    """Build the single Firestore document holding a user's profile and assets"""
+    return {
+        "uid": user_id,
+        "last_seen": datetime.now().isoformat(),
+        "persona": profile_data.get("persona"),
+        "onboarding_completed": profile_data.get("onboarding_complete", False),
+        "financial_goals": profile_data.get("financial_goals", []),
+        "spending_habits": profile_data.get("spending_habits"),
+        "risk_appetite": profile_data.get("risk_appetite"),
+        "investment_interests": profile_data.get("investment_interests", []),
+        "has_invested_before": profile_data.get("has_invested_before"),
+        "recurring_bills": profile_data.get("recurring_bills", []),
+        # Store all assets directly in the main document
+        "real_estate_assets": profile_data.get("real_estate_assets", []),
+        "gold_assets": profile_data.get("gold_assets", []),
+        "stock_assets": profile_data.get("stock_assets", []),
+        "vehicle_assets": profile_data.get("vehicle_assets", []),
+        "crypto_assets": profile_data.get("crypto_assets", []),
+        "updated_at": datetime.now().isoformat()
+    }
+
+
 def save_user_profile_data(
     firestore_service: FirestoreService,
     user_id: str,
@@ -34,25 +57,7 @@ def save_user_profile_data(
     """Save complete user profile data to Firestore - all in one document"""
     try:
         # Prepare complete user data with all assets embedded
-        user_data = {
-            "uid": user_id,
-            "last_seen": datetime.now().isoformat(),
-            "persona": profile_data.get("persona"),
-            "onboarding_completed": profile_data.get("onboarding_complete", False),
-            "financial_goals": profile_data.get("financial_goals", []),
-            "spending_habits": profile_data.get("spending_habits"),
-            "risk_appetite": profile_data.get("risk_appetite"),
-            "investment_interests": profile_data.get("investment_interests", []),
-            "has_invested_before": profile_data.get("has_invested_before"),
-            "recurring_bills": profile_data.get("recurring_bills", []),
-            # Store all assets directly in the main document
-            "real_estate_assets": profile_data.get("real_estate_assets", []),
-            "gold_assets": profile_data.get("gold_assets", []),
-            "stock_assets": profile_data.get("stock_assets", []),
-            "vehicle_assets": profile_data.get("vehicle_assets", []),
-            "crypto_assets": profile_data.get("crypto_assets", []),
-            "updated_at": datetime.now().isoformat()
-        }
+        user_data = build_user_profile_document(user_id, profile_data)
         
         # Save everything to main document (using sync method for hackathon speed)
         firestore_service.client.collection("wallet_user_collection").document(user_id).set(user_data, merge=True)
@@ -1,5 +1,4 @@
 # Receipt Scanner Agent Module
-from .agent import SimplifiedReceiptAgent, get_receipt_scanner_agent
 
 # Export the main agent components
 __all__ = [
@@ -7,5 +6,17 @@ __all__ = [
     "get_receipt_scanner_agent",
 ]
 
-# Make the agent available as 'root_agent' for backward compatibility
-root_agent = get_receipt_scanner_agent()
+
+def __getattr__(name):
+    # The agent module is only imported on first access, so importing the
+    # package (e.g. just for its prompts or schemas) does not load Vertex AI
+    # or PIL. 'root_agent' is kept for backward compatibility.
+    if name in __all__:
+        from . import agent
+
+        return getattr(agent, name)
+    if name == "root_agent":
+        from .agent import get_receipt_scanner_agent
+
+        return get_receipt_scanner_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
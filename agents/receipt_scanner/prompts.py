@@ -3,9 +3,12 @@ Prompts for the ADK-based Receipt Scanner Agent.
 Contains prompts that generate a rich, structured JSON output.
 """
 
+import functools
+
 from config.constants import TRANSACTION_CATEGORIES
 
 
+@functools.lru_cache(maxsize=4)
 def create_simplified_prompt(media_type: str) -> str:
     """
     Creates a simplified, powerful prompt that guides the LLM to produce a clean
@@ -76,3 +79,23 @@ Now, analyze the provided receipt and generate the JSON output in the exact same
 5.  **Accuracy:** Ensure all numbers are correct. `amount` must be the final total.
 6.  **Completeness:** If a field is not on the receipt, use `null` or a sensible default.
 """
+
+
+@functools.lru_cache(maxsize=16)
+def create_batch_prompt(image_count: int) -> str:
+    """
+    Creates a prompt that analyzes several receipt images in a single request.
+
+    Args:
+        image_count: Number of receipt images attached after the prompt.
+
+    Returns:
+        A prompt asking Gemini for one JSON object per image, in order.
+    """
+    return f"""
+You are given {image_count} separate receipt images, in order.
+Analyze each image on its own using the instructions below. The instructions describe
+the JSON object for ONE receipt; return a single JSON array containing exactly
+{image_count} such objects, one per image, in the same order as the images.
+Do not add any text before or after the JSON array.
+{create_simplified_prompt("image")}"""
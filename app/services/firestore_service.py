@@ -22,6 +22,9 @@ from agents.onboarding_agent.schemas import UserProfile
 settings = get_settings()
 logger = get_logger(__name__)
 
+# Firestore accepts at most 500 writes per batch commit
+MAX_BATCH_WRITES = 500
+
 
 class FirestoreService:
     """Async Firestore service for database operations"""
@@ -73,6 +76,27 @@ class FirestoreService:
         if not self._initialized or not self.client:
             raise RuntimeError("Firestore service not initialized")
 
+    # Bulk Operations
+    async def bulk_write(
+        self, collection: str, documents: Dict[str, Dict[str, Any]], merge: bool = True
+    ) -> int:
+        """Set many documents in a collection, committing up to 500 writes per RPC"""
+        self._ensure_initialized()
+        items = list(documents.items())
+        try:
+            for start in range(0, len(items), MAX_BATCH_WRITES):
+                batch = self.client.batch()
+                for doc_id, data in items[start : start + MAX_BATCH_WRITES]:
+                    doc_ref = self.client.collection(collection).document(doc_id)
+                    batch.set(doc_ref, data, merge=merge)
+                await batch.commit()
+
+            logger.info(f"Bulk wrote {len(items)} documents to {collection}")
+            return len(items)
+        except Exception as e:
+            logger.error(f"Bulk write to {collection} failed: {e}", exc_info=True)
+            raise
+
     # Onboarding Agent Operations
     async def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
         """Retrieves a user profile from Firestore."""
@@ -0,0 +1,35 @@
+"""
+Shared asyncio/aiohttp helpers for the async API test scripts
+"""
+
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+try:
+    import uvloop
+except ImportError:  # Optional; not available on Windows
+    uvloop = None
+
+# Event loop runner; uvloop.run only exists from uvloop 0.18, so older
+# installs fall back to the stock loop
+run_loop = getattr(uvloop, "run", None) or asyncio.run
+
+# Status polling backoff (seconds)
+POLL_MIN_DELAY = 0.5
+POLL_MAX_DELAY = 8.0
+POLL_ERROR_MAX_DELAY = 60.0
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def create_session(
+    timeout: Optional[aiohttp.ClientTimeout] = None,
+) -> aiohttp.ClientSession:
+    """Create the HTTP session shared by every request in a run (keep-alive pool)"""
+    connector = aiohttp.TCPConnector(
+        limit=32, limit_per_host=32, ttl_dns_cache=300, keepalive_timeout=75
+    )
+    if timeout is None:
+        return aiohttp.ClientSession(connector=connector)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
@@ -4,77 +4,160 @@ Unified API Test - Multipart File Upload
 Tests the enhanced API using multipart/form-data uploads (no more base64!)
 """
 
-import json
-import time
-import requests
+import asyncio
+import functools
+import hashlib
+import io
+import os
+import random
+import tempfile
+import aiohttp
+import orjson
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
 
+from async_helpers import (
+    POLL_ERROR_MAX_DELAY,
+    POLL_MAX_DELAY,
+    POLL_MIN_DELAY,
+    RETRYABLE_STATUSES,
+    create_session,
+    run_loop,
+)
+
 # API Configuration
 API_BASE = "http://localhost:8080/api/v1"
 RECEIPTS_API = f"{API_BASE}/receipts"
 
+VIDEO_EXTENSIONS = frozenset({".mp4", ".mov", ".avi"})
+
+
+# Synthetic receipt content, shared by every create_test_image() call
+RECEIPT_LINES = (
+    "QUICK MART",
+    "123 Test Street",
+    "City, ST 12345",
+    "Tel: (555) 123-4567",
+    "",
+    "Receipt #: TST-001",
+    "Date: 2024-01-15",
+    "Time: 14:30:25",
+    "",
+    "ITEMS:",
+    "Coffee           $4.50",
+    "Donut            $2.25",
+    "Newspaper        $1.50",
+    "",
+    "Subtotal:        $8.25",
+    "Tax (8.5%):      $0.70",
+    "TOTAL:           $8.95",
+    "",
+    "Payment: Cash",
+    "",
+    "Thank you!",
+)
+
+# Line heights: headings use the large font, other text the small one
+HEADING_LINE_HEIGHTS = {"QUICK MART": 35, "ITEMS:": 30, "TOTAL:": 30}
+BODY_LINE_HEIGHT = 25
+BLANK_LINE_HEIGHT = 15
+
+
+def _layout_receipt(lines: tuple) -> tuple:
+    """Group receipt lines into (y, text, is_heading) blocks.
+
+    Consecutive body lines are joined so each run is drawn with a single
+    multiline_text call instead of one draw.text call per line.
+    """
+    blocks = []
+    body = []
+    body_y = y = 30
 
-def create_test_image() -> str:
-    """Create a synthetic test receipt image and save to file"""
-    # Create a simple receipt image
-    img = Image.new("RGB", (400, 600), color="white")
-    draw = ImageDraw.Draw(img)
+    for line in lines:
+        if line and line not in HEADING_LINE_HEIGHTS:
+            if not body:
+                body_y = y
+            body.append(line)
+            y += BODY_LINE_HEIGHT
+            continue
+
+        if body:
+            blocks.append((body_y, "\n".join(body), False))
+            body = []
+
+        if line:
+            blocks.append((y, line, True))
+            y += HEADING_LINE_HEIGHTS[line]
+        else:
+            y += BLANK_LINE_HEIGHT
+
+    if body:
+        blocks.append((body_y, "\n".join(body), False))
 
+    return tuple(blocks)
+
+
+RECEIPT_BLOCKS = _layout_receipt(RECEIPT_LINES)
+
+# Small, OCR-legible JPEG; quality matters little for a synthetic fixture
+JPEG_SAVE_OPTIONS = {"quality": 75, "optimize": True, "progressive": True}
+
+# Rendered image is cached on disk; the name changes whenever the content does
+_RECEIPT_DIGEST = hashlib.sha1(
+    repr((RECEIPT_BLOCKS, JPEG_SAVE_OPTIONS)).encode()
+).hexdigest()[:8]
+TEST_IMAGE_CACHE = (
+    Path(tempfile.gettempdir()) / f"synthetic_receipt_{_RECEIPT_DIGEST}.jpg"
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_fonts() -> tuple:
+    """Load the (title, body) fonts once, only when an image is rendered"""
     # Try to use a better font, fall back to default if not available
     try:
-        font = ImageFont.truetype("arial.ttf", 20)
-        small_font = ImageFont.truetype("arial.ttf", 16)
+        return ImageFont.truetype("arial.ttf", 20), ImageFont.truetype("arial.ttf", 16)
     except Exception:
-        font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
-
-    # Draw receipt content
-    y = 30
-    lines = [
-        "QUICK MART",
-        "123 Test Street",
-        "City, ST 12345",
-        "Tel: (555) 123-4567",
-        "",
-        "Receipt #: TST-001",
-        "Date: 2024-01-15",
-        "Time: 14:30:25",
-        "",
-        "ITEMS:",
-        "Coffee           $4.50",
-        "Donut            $2.25",
-        "Newspaper        $1.50",
-        "",
-        "Subtotal:        $8.25",
-        "Tax (8.5%):      $0.70",
-        "TOTAL:           $8.95",
-        "",
-        "Payment: Cash",
-        "",
-        "Thank you!",
-    ]
+        return ImageFont.load_default(), ImageFont.load_default()
 
-    for line in lines:
-        if line == "QUICK MART":
-            draw.text((50, y), line, fill="black", font=font)
-            y += 35
-        elif line in ["ITEMS:", "TOTAL:"]:
-            draw.text((50, y), line, fill="black", font=font)
-            y += 30
-        elif line == "":
-            y += 15
+
+@functools.lru_cache(maxsize=1)
+def create_test_image() -> bytes:
+    """Return the synthetic test receipt as raw JPEG bytes, rendering it once"""
+    try:
+        return TEST_IMAGE_CACHE.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    image_bytes = _render_test_image()
+    TEST_IMAGE_CACHE.write_bytes(image_bytes)
+    return image_bytes
+
+
+def _render_test_image() -> bytes:
+    """Render the synthetic test receipt image to JPEG bytes"""
+    # Create a simple receipt image
+    img = Image.new("RGB", (400, 600), color="white")
+    draw = ImageDraw.Draw(img)
+    font, small_font = _load_fonts()
+
+    # Draw receipt content, keeping body lines on the fixed line pitch
+    body_spacing = BODY_LINE_HEIGHT - draw.textbbox((0, 0), "A", font=small_font)[3]
+    for y, text, is_heading in RECEIPT_BLOCKS:
+        if is_heading:
+            draw.text((50, y), text, fill="black", font=font)
         else:
-            draw.text((50, y), line, fill="black", font=small_font)
-            y += 25
+            draw.multiline_text(
+                (50, y), text, fill="black", font=small_font, spacing=body_spacing
+            )
 
-    # Save to file and return path
-    test_image_path = "test_receipt_synthetic.jpg"
-    img.save(test_image_path, format="JPEG", quality=90)
-    return test_image_path
+    # Encode in memory - the bytes go straight into the multipart body
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", **JPEG_SAVE_OPTIONS)
+    return buffer.getvalue()
 
 
-def test_image_analysis():
+async def test_image_analysis(session: aiohttp.ClientSession) -> bool:
     """Test image analysis with multipart upload"""
     print("📸 Testing Image Analysis (Multipart Upload)")
     print("=" * 50)
@@ -82,59 +165,63 @@ def test_image_analysis():
     try:
         # Create test image
         print("1. Creating synthetic receipt image...")
-        image_path = create_test_image()
-        image_size_mb = Path(image_path).stat().st_size / 1024 / 1024
-        print(f"   ✅ Image created: {image_path} ({image_size_mb:.2f} MB)")
+        image_bytes = create_test_image()
+        image_size_mb = len(image_bytes) / 1024 / 1024
+        print(f"   ✅ Image created in memory ({image_size_mb:.2f} MB)")
 
         # Upload with multipart form-data
         print("2. Uploading with multipart form-data...")
 
-        with open(image_path, "rb") as f:
-            files = {"file": ("test_receipt.jpg", f, "image/jpeg")}
-            data = {
-                "user_id": "unified_test_user",
-                "metadata": json.dumps(
-                    {
-                        "source": "unified_test",
-                        "type": "synthetic_image",
-                        "test_id": "IMG_001",
-                    }
-                ),
-            }
-
-            response = requests.post(f"{RECEIPTS_API}/upload", files=files, data=data)
+        form = aiohttp.FormData()
+        form.add_field(
+            "file", image_bytes, filename="test_receipt.jpg", content_type="image/jpeg"
+        )
+        form.add_field("user_id", "unified_test_user")
+        form.add_field(
+            "metadata",
+            orjson.dumps(
+                {
+                    "source": "unified_test",
+                    "type": "synthetic_image",
+                    "test_id": "IMG_001",
+                }
+            ).decode(),
+        )
+
+        async with session.post(f"{RECEIPTS_API}/upload", data=form) as response:
+            if response.status != 202:
+                print(f"   ❌ Upload failed: {response.status}")
+                print(f"   Response: {await response.text()}")
+                return False
 
-        if response.status_code != 202:
-            print(f"   ❌ Upload failed: {response.status_code}")
-            print(f"   Response: {response.text}")
-            return False
+            upload_data = orjson.loads(await response.read())
 
-        upload_data = response.json()
         token = upload_data["processing_token"]
         print(f"   ✅ Upload successful - Token: {token}")
 
-        # Clean up test file
-        Path(image_path).unlink()
-
         # Poll for results
         print("3. Processing image with Gemini 2.5 Flash...")
-        return poll_for_results(token, "image")
+        return await poll_for_results(session, token, "image")
 
     except Exception as e:
         print(f"❌ Image test failed: {e}")
         return False
 
 
-def test_video_analysis():
+async def test_video_analysis(session: aiohttp.ClientSession) -> bool:
     """Test video analysis with multipart upload"""
     print("\n🎥 Testing Video Analysis (Multipart Upload)")
     print("=" * 50)
 
     try:
-        # Look for existing video files
-        video_files = []
-        for ext in [".mp4", ".mov", ".avi"]:
-            video_files.extend(list(Path(".").glob(f"*{ext}")))
+        # Look for existing video files (single directory pass)
+        with os.scandir(".") as entries:
+            video_files = [
+                Path(entry.name)
+                for entry in entries
+                if entry.is_file()
+                and os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS
+            ]
 
         if not video_files:
             print("   ⚠️  No video files found in current directory")
@@ -157,10 +244,14 @@ def test_video_analysis():
         print("2. Uploading with multipart form-data...")
 
         with open(video_path, "rb") as f:
-            files = {"file": (video_path.name, f, "video/mp4")}
-            data = {
-                "user_id": "unified_test_user",
-                "metadata": json.dumps(
+            form = aiohttp.FormData()
+            form.add_field(
+                "file", f, filename=video_path.name, content_type="video/mp4"
+            )
+            form.add_field("user_id", "unified_test_user")
+            form.add_field(
+                "metadata",
+                orjson.dumps(
                     {
                         "source": "unified_test",
                         "type": "real_video",
@@ -168,65 +259,85 @@ def test_video_analysis():
                         "size_mb": video_size_mb,
                         "test_id": "VID_001",
                     }
-                ),
-            }
+                ).decode(),
+            )
 
-            response = requests.post(f"{RECEIPTS_API}/upload", files=files, data=data)
+            async with session.post(f"{RECEIPTS_API}/upload", data=form) as response:
+                if response.status != 202:
+                    print(f"   ❌ Upload failed: {response.status}")
+                    print(f"   Response: {await response.text()}")
+                    return False
 
-        if response.status_code != 202:
-            print(f"   ❌ Upload failed: {response.status_code}")
-            print(f"   Response: {response.text}")
-            return False
+                upload_data = orjson.loads(await response.read())
 
-        upload_data = response.json()
         token = upload_data["processing_token"]
         print(f"   ✅ Upload successful - Token: {token}")
 
         # Poll for results
         print("3. Processing video with Gemini 2.5 Flash...")
         print("   📹 Video analysis may take longer...")
-        return poll_for_results(token, "video")
+        return await poll_for_results(session, token, "video")
 
     except Exception as e:
         print(f"❌ Video test failed: {e}")
         return False
 
 
-def poll_for_results(token: str, media_type: str) -> bool:
+async def poll_for_results(
+    session: aiohttp.ClientSession, token: str, media_type: str
+) -> bool:
     """Poll for processing results"""
     max_attempts = 30 if media_type == "image" else 40
     attempt = 0
+    delay = error_delay = POLL_MIN_DELAY
+    last_percentage = last_state = None
 
     while attempt < max_attempts:
         attempt += 1
-        print(f"   Polling... {attempt}/{max_attempts}")
 
         try:
-            response = requests.get(f"{RECEIPTS_API}/status/{token}")
+            async with session.get(f"{RECEIPTS_API}/status/{token}") as response:
+                if response.status in RETRYABLE_STATUSES:
+                    print(f"   ⚠️  Status check returned {response.status}, retrying")
+                    await asyncio.sleep(error_delay)
+                    error_delay = min(POLL_ERROR_MAX_DELAY, error_delay * 2)
+                    continue
 
-            if response.status_code != 200:
-                print(f"   ❌ Status check failed: {response.status_code}")
-                return False
+                if response.status != 200:
+                    print(f"   ❌ Status check failed: {response.status}")
+                    return False
 
-            data = response.json()
+                data = orjson.loads(await response.read())
+
+            error_delay = POLL_MIN_DELAY
             status = data["status"]
             progress = data["progress"]
 
-            print(
-                f"   Status: {status} - {progress['stage']} ({progress['percentage']:.1f}%)"
-            )
+            # Only report when something changed, not on every poll
+            state = (status, progress["stage"], progress["percentage"])
+            if state != last_state:
+                last_state = state
+                print(
+                    f"   [{attempt}/{max_attempts}] Status: {status} - "
+                    f"{progress['stage']} ({progress['percentage']:.1f}%)"
+                )
 
             if status == "completed":
-                print(f"\n🎉 {media_type.title()} Analysis Completed!")
-
                 result = data["result"]
-                print("\n📊 Analysis Results:")
-                print(f"🏪 Store: {result['place']}")
-                print(f"💰 Total: ${result['amount']:.2f}")
-                print(f"📂 Category: {result['category']}")
-                print(f"📝 Description: {result['description']}")
-                print(f"📅 Time: {result['time']}")
-                print(f"💳 Type: {result['transactionType']}")
+                print(
+                    "\n".join(
+                        [
+                            f"\n🎉 {media_type.title()} Analysis Completed!",
+                            "\n📊 Analysis Results:",
+                            f"🏪 Store: {result['place']}",
+                            f"💰 Total: ${result['amount']:.2f}",
+                            f"📂 Category: {result['category']}",
+                            f"📝 Description: {result['description']}",
+                            f"📅 Time: {result['time']}",
+                            f"💳 Type: {result['transactionType']}",
+                        ]
+                    )
+                )
 
                 return True
 
@@ -237,7 +348,13 @@ def poll_for_results(token: str, media_type: str) -> bool:
                     print(f"Error: {error.get('message', 'Unknown error')}")
                 return False
 
-            time.sleep(3)
+            # Back off while progress stalls, poll quickly again once it moves
+            if progress["percentage"] != last_percentage:
+                last_percentage = progress["percentage"]
+                delay = POLL_MIN_DELAY
+            else:
+                delay = min(POLL_MAX_DELAY, delay * 1.5)
+            await asyncio.sleep(delay + random.uniform(0, delay * 0.1))
 
         except Exception as e:
             print(f"   ❌ Polling failed: {e}")
@@ -247,7 +364,7 @@ def poll_for_results(token: str, media_type: str) -> bool:
     return False
 
 
-def test_api_validation():
+async def test_api_validation(session: aiohttp.ClientSession):
     """Test API validation for required fields"""
     print("\n🔍 Testing API Validation")
     print("=" * 50)
@@ -273,48 +390,66 @@ def test_api_validation():
         },
     ]
 
-    for i, test_case in enumerate(test_cases, 1):
+    # The cases are independent, so send them all at once and report in order
+    responses = await asyncio.gather(
+        *(_post_validation_case(session, test_case) for test_case in test_cases),
+        return_exceptions=True,
+    )
+
+    for i, (test_case, response) in enumerate(zip(test_cases, responses), 1):
         print(f"{i}. Testing: {test_case['name']}")
 
-        try:
-            response = requests.post(
-                f"{RECEIPTS_API}/upload",
-                files=test_case["files"],
-                data=test_case["data"],
-            )
+        if isinstance(response, Exception):
+            print(f"   ❌ Test failed: {response}")
+            continue
 
-            if response.status_code in [400, 422]:  # Validation error
-                error_data = response.json()
-                error_msg = str(error_data)
+        status_code, body = response
+        if status_code in [400, 422]:  # Validation error
+            try:
+                error_msg = str(orjson.loads(body))
+            except orjson.JSONDecodeError:
+                error_msg = body.decode(errors="replace")
 
-                if test_case["expected_error"] in error_msg:
-                    print(f"   ✅ Correctly rejected: {test_case['expected_error']}")
-                else:
-                    print(f"   ⚠️  Unexpected error: {error_msg}")
+            if test_case["expected_error"] in error_msg:
+                print(f"   ✅ Correctly rejected: {test_case['expected_error']}")
             else:
-                print(
-                    f"   ❌ Expected validation error but got: {response.status_code}"
-                )
+                print(f"   ⚠️  Unexpected error: {error_msg}")
+        else:
+            print(f"   ❌ Expected validation error but got: {status_code}")
 
-        except Exception as e:
-            print(f"   ❌ Test failed: {e}")
+
+async def _post_validation_case(
+    session: aiohttp.ClientSession, test_case: dict
+) -> tuple[int, bytes]:
+    """Send one validation case and return its status code and raw body"""
+    form = aiohttp.FormData()
+    for name, (filename, content, content_type) in test_case["files"].items():
+        form.add_field(name, content, filename=filename, content_type=content_type)
+    for name, value in test_case["data"].items():
+        form.add_field(name, value)
+
+    async with session.post(
+        f"{RECEIPTS_API}/upload", data=form, timeout=aiohttp.ClientTimeout(total=5)
+    ) as response:
+        return response.status, await response.read()
 
 
-def main():
+async def main():
     """Main test function"""
     print("🚀 Unified API Test - Multipart File Upload")
     print("=" * 70)
     print("Testing the enhanced API using efficient multipart/form-data uploads")
     print("=" * 70)
 
-    # Test API validation first
-    test_api_validation()
+    async with create_session() as session:
+        # Test API validation first
+        await test_api_validation(session)
 
-    # Test image analysis
-    image_success = test_image_analysis()
+        # Test image analysis
+        image_success = await test_image_analysis(session)
 
-    # Test video analysis (if video files available)
-    video_success = test_video_analysis()
+        # Test video analysis (if video files available)
+        video_success = await test_video_analysis(session)
 
     # Summary
     print("\n" + "=" * 70)
@@ -331,4 +466,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run_loop(main())
@@ -1,7 +1,15 @@
 # scripts/test_onboarding_flow.py
 import requests
 import json
+import os
+import sys
 import time
+from requests.adapters import HTTPAdapter
+
+try:
+    import readline  # noqa: F401 - gives input() line editing and history
+except ImportError:  # Not available on Windows
+    pass
 
 # --- Configuration ---
 BASE_URL = "http://localhost:8080"
@@ -10,6 +18,10 @@ USER_ID = f"interactive-user-{int(time.time())}"
 SESSION_ID = f"interactive-session-{int(time.time())}"
 LANGUAGE = "en"
 
+# One pooled keep-alive session for the whole conversation
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+
 # --- Style (for terminals that support ANSI colors) ---
 class bcolors:
     HEADER = '\033[95m'
@@ -20,6 +32,17 @@ class bcolors:
     ENDC = '\033[0m'
     BOLD = '\033[1m'
 
+class _nocolors:
+    HEADER = OKBLUE = OKGREEN = WARNING = FAIL = ENDC = BOLD = ''
+
+# Plain text when output is piped or NO_COLOR is set
+if not sys.stdout.isatty() or os.environ.get("NO_COLOR"):
+    bcolors = _nocolors
+
+# Per-turn strings, formatted once
+USER_PROMPT = f"\n{bcolors.BOLD}You: {bcolors.ENDC}"
+WALLY_PREFIX = f"\n{bcolors.OKGREEN}🤖 Wally:{bcolors.ENDC} "
+
 def make_api_call(query: str):
     """Makes a single API call to the chatbot endpoint."""
     payload = {
@@ -29,7 +52,7 @@ def make_api_call(query: str):
         "session_id": SESSION_ID
     }
     try:
-        response = requests.post(f"{BASE_URL}{ENDPOINT}", json=payload)
+        response = SESSION.post(f"{BASE_URL}{ENDPOINT}", json=payload)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -53,12 +76,12 @@ def start_chatbot():
     if not initial_response:
         return  # Exit if the first call fails
 
-    print(f"\n{bcolors.OKGREEN}🤖 Wally:{bcolors.ENDC} {initial_response.get('response', '...')}")
+    print(f"{WALLY_PREFIX}{initial_response.get('response', '...')}")
 
     # 2. Start the interactive loop
     while True:
         try:
-            user_input = input(f"\n{bcolors.BOLD}You: {bcolors.ENDC}")
+            user_input = input(USER_PROMPT)
         except KeyboardInterrupt:
             print(f"\n{bcolors.WARNING}👋 Chat ended by user.{bcolors.ENDC}")
             break
@@ -74,7 +97,7 @@ def start_chatbot():
         if not response_data:
             continue  # Loop again if the call failed
 
-        print(f"\n{bcolors.OKGREEN}🤖 Wally:{bcolors.ENDC} {response_data.get('response', '...')}")
+        print(f"{WALLY_PREFIX}{response_data.get('response', '...')}")
 
         if response_data.get("onboarding_complete"):
             print(f"\n{bcolors.HEADER}🎉 Onboarding Complete! Wally has finished the conversation.{bcolors.ENDC}")
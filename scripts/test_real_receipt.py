@@ -4,54 +4,98 @@ Test script for real receipt media (images and videos)
 Upload and analyze actual receipt photos or videos
 """
 
-import json
+import argparse
+import asyncio
+import io
+import logging
+import os
+import random
+import stat
+import sys
 import time
-import requests
+import aiohttp
+import orjson
+from contextvars import ContextVar
 from pathlib import Path
+from typing import Optional
+
+from async_helpers import (
+    POLL_ERROR_MAX_DELAY,
+    POLL_MAX_DELAY,
+    POLL_MIN_DELAY,
+    RETRYABLE_STATUSES,
+    create_session,
+    run_loop,
+)
 
 # API Configuration
 API_BASE = "http://localhost:8080/api/v1"
 RECEIPTS_API = f"{API_BASE}/receipts"
 
+logger = logging.getLogger(__name__)
+
+# Upper bound on receipts analyzed at once; keeps the backend from being swamped
+MAX_CONCURRENT = int(os.environ.get("MAX_CONCURRENT", "8"))
+
+# Uploads can be large videos, so allow a long total but bound each read
+SESSION_TIMEOUT = aiohttp.ClientTimeout(total=300, sock_connect=30, sock_read=120)
+
+# Supported media, matching the extensions accepted by the upload endpoint
+IMAGE_EXTS = frozenset({".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"})
+VIDEO_EXTS = frozenset({".mp4", ".mov", ".avi", ".mkv", ".webm"})
+EXT_TO_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".mp4": "video/mp4",
+    ".mov": "video/quicktime",
+    ".avi": "video/avi",
+}
+
+
+# Per-task output buffer used while several receipts are analyzed at once
+_output_buffer: "ContextVar[Optional[io.StringIO]]" = ContextVar(
+    "output_buffer", default=None
+)
 
-def get_file_info(file_path: str) -> tuple[float, str]:
-    """Get file size and appropriate MIME type"""
-    try:
-        file_size_mb = Path(file_path).stat().st_size / 1024 / 1024
-        file_extension = Path(file_path).suffix.lower()
-
-        # Determine MIME type
-        if file_extension in [".jpg", ".jpeg"]:
-            mime_type = "image/jpeg"
-        elif file_extension == ".png":
-            mime_type = "image/png"
-        elif file_extension == ".gif":
-            mime_type = "image/gif"
-        elif file_extension in [".mp4"]:
-            mime_type = "video/mp4"
-        elif file_extension in [".mov"]:
-            mime_type = "video/quicktime"
-        elif file_extension in [".avi"]:
-            mime_type = "video/avi"
-        else:
-            mime_type = "application/octet-stream"
 
-        return file_size_mb, mime_type
-    except Exception as e:
-        raise ValueError(f"Failed to get file info for {file_path}: {str(e)}")
+class _TaskOutput:
+    """stdout wrapper that sends each asyncio task's prints to its own buffer"""
 
+    def __init__(self, stream):
+        self.stream = stream
 
-def analyze_real_receipt(media_path: str, user_id: str = "real_test_user"):
+    def write(self, text):
+        buffer = _output_buffer.get()
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def get_file_info(file_path: Path, file_stat: os.stat_result) -> tuple[float, str]:
+    """Get file size and appropriate MIME type from an existing stat result"""
+    file_size_mb = file_stat.st_size / 1024 / 1024
+    file_extension = file_path.suffix.lower()
+    mime_type = EXT_TO_MIME.get(file_extension, "application/octet-stream")
+    return file_size_mb, mime_type
+
+
+async def analyze_real_receipt(
+    session: aiohttp.ClientSession, media_path: str, user_id: str = "real_test_user"
+):
     """Analyze a real receipt image or video"""
 
     # Determine media type from file extension
     media_path_obj = Path(media_path)
+    file_name = media_path_obj.name
     extension = media_path_obj.suffix.lower()
 
-    if extension in [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"]:
+    if extension in IMAGE_EXTS:
         media_type = "image"
         icon = "📸"
-    elif extension in [".mp4", ".mov", ".avi", ".mkv", ".webm"]:
+    elif extension in VIDEO_EXTS:
         media_type = "video"
         icon = "🎥"
     else:
@@ -64,14 +108,18 @@ def analyze_real_receipt(media_path: str, user_id: str = "real_test_user"):
 
     try:
         start_time = time.time()
-        # Check if media file exists
-        if not Path(media_path).exists():
+        # Check if media file exists; the same stat() feeds the file info
+        try:
+            file_stat = media_path_obj.stat()
+        except FileNotFoundError:
+            file_stat = None
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
             print(f"❌ {media_type.title()} file not found: {media_path}")
             return
 
         # Get file info
         print(f"1. Preparing {media_type} for upload...")
-        file_size_mb, mime_type = get_file_info(media_path)
+        file_size_mb, mime_type = get_file_info(media_path_obj, file_stat)
         print(f"   ✅ {media_type.title()} ready: {file_size_mb:.2f} MB ({mime_type})")
 
         size_limit = 10 if media_type == "image" else 100
@@ -83,30 +131,32 @@ def analyze_real_receipt(media_path: str, user_id: str = "real_test_user"):
         # Upload receipt with multipart form-data
         print(f"2. Uploading receipt {media_type} with multipart form-data...")
 
-        with open(media_path, "rb") as f:
-            files = {"file": (Path(media_path).name, f, mime_type)}
-            data = {
-                "user_id": user_id,
-                "metadata": json.dumps(
+        with open(media_path_obj, "rb") as f:
+            form = aiohttp.FormData()
+            form.add_field("file", f, filename=file_name, content_type=mime_type)
+            form.add_field("user_id", user_id)
+            form.add_field(
+                "metadata",
+                orjson.dumps(
                     {
                         "source": f"real_{media_type}_test",
-                        "filename": Path(media_path).name,
+                        "filename": file_name,
                         "size_mb": file_size_mb,
                         "media_type": media_type,
                     }
-                ),
-            }
-
-            upload_response = requests.post(
-                f"{RECEIPTS_API}/upload", files=files, data=data
+                ).decode(),
             )
 
-        if upload_response.status_code != 202:
-            print(f"   ❌ Upload failed: {upload_response.status_code}")
-            print(f"   Response: {upload_response.text}")
-            return
+            async with session.post(
+                f"{RECEIPTS_API}/upload", data=form
+            ) as upload_response:
+                if upload_response.status != 202:
+                    print(f"   ❌ Upload failed: {upload_response.status}")
+                    print(f"   Response: {await upload_response.text()}")
+                    return
+
+                upload_data = orjson.loads(await upload_response.read())
 
-        upload_data = upload_response.json()
         token = upload_data["processing_token"]
         print(f"   ✅ Upload successful - Token: {token}")
 
@@ -115,44 +165,67 @@ def analyze_real_receipt(media_path: str, user_id: str = "real_test_user"):
         if media_type == "video":
             print("   📹 Video analysis may take longer than images...")
         max_attempts = 30 if media_type == "image" else 40  # Videos might take longer
+        poll_budget = 90 if media_type == "image" else 120  # Seconds of wall time
+        deadline = time.monotonic() + poll_budget
         attempt = 0
+        delay = error_delay = POLL_MIN_DELAY
+        last_percentage = last_state = None
 
-        while attempt < max_attempts:
+        while attempt < max_attempts and time.monotonic() < deadline:
             attempt += 1
-            print(f"   Polling... {attempt}/{max_attempts}")
 
-            status_response = requests.get(f"{RECEIPTS_API}/status/{token}")
+            async with session.get(
+                f"{RECEIPTS_API}/status/{token}"
+            ) as status_response:
+                if status_response.status in RETRYABLE_STATUSES:
+                    print(
+                        f"   ⚠️  Status check returned {status_response.status}, retrying"
+                    )
+                    await asyncio.sleep(error_delay)
+                    error_delay = min(POLL_ERROR_MAX_DELAY, error_delay * 2)
+                    continue
 
-            if status_response.status_code != 200:
-                print(f"   ❌ Status check failed: {status_response.status_code}")
-                break
+                if status_response.status != 200:
+                    print(f"   ❌ Status check failed: {status_response.status}")
+                    break
+
+                status_data = orjson.loads(await status_response.read())
 
-            status_data = status_response.json()
+            error_delay = POLL_MIN_DELAY
             status = status_data["status"]
             progress = status_data["progress"]
 
-            print(
-                f"   Status: {status} - {progress['stage']} ({progress['percentage']:.1f}%)"
-            )
+            # Only report when something changed, not on every poll
+            state = (status, progress["stage"], progress["percentage"])
+            if state != last_state:
+                last_state = state
+                print(
+                    f"   [{attempt}/{max_attempts}] Status: {status} - "
+                    f"{progress['stage']} ({progress['percentage']:.1f}%)"
+                )
 
             if status == "completed":
-                print("\n🎉 Analysis Completed!")
-
                 # Display detailed results
                 result = status_data["result"]
-                print("\n📊 Receipt Analysis Results:")
-                print(f"🏪 Store: {result['place']}")
-                print(f"💰 Total Amount: ${result['amount']:.2f}")
-                print(f"📂 Category: {result['category']}")
-                print(f"📝 Description: {result['description']}")
-                print(f"📅 Transaction Time: {result['time']}")
-                print(f"💳 Transaction Type: {result['transactionType']}")
-                print(f"⭐ Importance: {result.get('importance', 'N/A')}")
-                print(f"🔄 Recurring: {result.get('recurring', False)}")
-                print(f"🛡️ Warranty: {result.get('warranty', False)}")
-
                 end_time = time.time()
-                print(f"\n⏱️ Total time taken: {end_time - start_time:.2f} seconds")
+                print(
+                    "\n".join(
+                        [
+                            "\n🎉 Analysis Completed!",
+                            "\n📊 Receipt Analysis Results:",
+                            f"🏪 Store: {result['place']}",
+                            f"💰 Total Amount: ${result['amount']:.2f}",
+                            f"📂 Category: {result['category']}",
+                            f"📝 Description: {result['description']}",
+                            f"📅 Transaction Time: {result['time']}",
+                            f"💳 Transaction Type: {result['transactionType']}",
+                            f"⭐ Importance: {result.get('importance', 'N/A')}",
+                            f"🔄 Recurring: {result.get('recurring', False)}",
+                            f"🛡️ Warranty: {result.get('warranty', False)}",
+                            f"\n⏱️ Total time taken: {end_time - start_time:.2f} seconds",
+                        ]
+                    )
+                )
 
                 return status_data
 
@@ -164,19 +237,56 @@ def analyze_real_receipt(media_path: str, user_id: str = "real_test_user"):
                     print(f"Error Message: {error.get('message', 'Unknown')}")
                 break
 
-            time.sleep(3)  # Wait a bit longer for real media
-
-        if attempt >= max_attempts:
+            # Back off while progress stalls, poll quickly again once it moves
+            if progress["percentage"] != last_percentage:
+                last_percentage = progress["percentage"]
+                delay = POLL_MIN_DELAY
+            else:
+                delay = min(POLL_MAX_DELAY, delay * 1.5)
+            # Never sleep past the deadline
+            pause = min(delay, max(0.0, deadline - time.monotonic()))
+            await asyncio.sleep(pause + random.uniform(0, pause * 0.1))
+        else:
             print("\n⏰ Processing timed out")
 
-    except Exception as e:
-        print(f"❌ Analysis failed: {str(e)}")
-        import traceback
+    except Exception:
+        logger.exception(f"❌ Analysis failed: {media_path}")
 
-        traceback.print_exc()
 
+async def analyze_all(media_paths: list[str], concurrency: Optional[int] = None):
+    """Analyze receipts concurrently over a single shared HTTP session"""
+    concurrency = concurrency or min(MAX_CONCURRENT, len(media_paths))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
 
-def main():
+    if len(media_paths) == 1:
+        async with create_session(SESSION_TIMEOUT) as session:
+            return [await analyze_real_receipt(session, media_paths[0])]
+
+    # Each receipt prints as one block when it finishes, instead of its steps
+    # interleaving with those of the receipts analyzed alongside it
+    output = _TaskOutput(sys.stdout)
+
+    async def analyze_bounded(media_path: str):
+        async with semaphore:
+            buffer = io.StringIO()
+            _output_buffer.set(buffer)  # Each gathered task has its own context
+            try:
+                return await analyze_real_receipt(session, media_path)
+            finally:
+                _output_buffer.set(None)
+                output.stream.write(buffer.getvalue() + "\n")
+
+    sys.stdout = output
+    try:
+        async with create_session(SESSION_TIMEOUT) as session:
+            return await asyncio.gather(
+                *(analyze_bounded(media_path) for media_path in media_paths)
+            )
+    finally:
+        sys.stdout = output.stream
+
+
+def main(concurrency: Optional[int] = None):
     """Main test function"""
     print("📸 Real Receipt Analysis Test")
     print("=" * 60)
@@ -193,14 +303,14 @@ def main():
 
     print("Looking for receipt images and videos in current directory...")
 
-    # Find available media
-    available_media = []
-    for media in test_media:
-        if Path(media).exists():
-            available_media.append(media)
-            ext = Path(media).suffix.lower()
-            media_type = "📸 Image" if ext in [".jpg", ".jpeg", ".png"] else "🎥 Video"
-            print(f"✅ Found {media_type}: {media}")
+    # Find available media with a single directory read
+    with os.scandir(".") as entries:
+        present = {entry.name for entry in entries if entry.is_file()}
+    available_media = [media for media in test_media if media in present]
+    for media in available_media:
+        ext = os.path.splitext(media)[1].lower()
+        media_type = "📸 Image" if ext in IMAGE_EXTS else "🎥 Video"
+        print(f"✅ Found {media_type}: {media}")
 
     if not available_media:
         print("\n❌ No receipt images or videos found!")
@@ -214,18 +324,24 @@ def main():
         return
 
     # Analyze each available media
-    for media_path in available_media:
-        analyze_real_receipt(media_path)
-        print("\n" + "=" * 60 + "\n")
+    run_loop(analyze_all(available_media, concurrency))
 
 
 if __name__ == "__main__":
-    import sys
-
-    if len(sys.argv) > 1:
-        # Custom image path provided
-        custom_path = sys.argv[1]
-        analyze_real_receipt(custom_path)
+    parser = argparse.ArgumentParser(description="Analyze real receipt media")
+    parser.add_argument(
+        "media_path", nargs="?", help="receipt image or video to analyze"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help=f"receipts analyzed at once (default: up to {MAX_CONCURRENT})",
+    )
+    args = parser.parse_args()
+
+    if args.media_path:
+        # Custom media path provided
+        run_loop(analyze_all([args.media_path], args.concurrency))
     else:
-        # Look for images in current directory
-        main()
+        # Look for media in current directory
+        main(args.concurrency)
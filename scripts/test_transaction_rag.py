@@ -5,12 +5,19 @@ Demonstrates the RAG-powered transaction query system
 """
 
 import asyncio
-import json
+import sys
 import time
 from datetime import datetime
-from typing import Dict, Any
+from operator import itemgetter
+from typing import Dict, Any, List
 
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from async_helpers import run_loop
 
 
 # Configuration
@@ -18,6 +25,40 @@ BASE_URL = "http://localhost:8080"
 TEST_USER_ID = "test_user_123"
 TEST_SESSION_ID = f"test_session_{int(time.time())}"
 
+# One pooled keep-alive session for every call in the suite
+SESSION = requests.Session()
+SESSION.headers.update({"Content-Type": "application/json"})
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
+# Chat queries in flight at once; keeps the RAG backend from being swamped
+MAX_CONCURRENT_QUERIES = 4
+
+# Chat response fields shown by print_response, with their fallbacks
+RESPONSE_DEFAULTS = {
+    "response": "No response",
+    "sources": [],
+    "metadata": {},
+    "query_type": "Unknown",
+    "confidence": 0,
+}
+RESPONSE_FIELDS = itemgetter(*RESPONSE_DEFAULTS)
+
+NEXT_STEPS = (
+    "\n🎯 Next Steps:",
+    "   1. Try more complex queries through the API",
+    "   2. Integrate with your frontend application",
+    "   3. Set up automatic transaction indexing",
+    "   4. Customize prompts and responses for your use case",
+    "\n📚 Documentation: agents/transaction_rag_agent/README.md",
+    f"🔗 API Docs: {BASE_URL}/docs",
+)
+
 
 def print_header(title: str):
     """Print a formatted header"""
@@ -26,52 +67,75 @@ def print_header(title: str):
     print(f"{'='*60}")
 
 
+def print_next_steps():
+    """Print the closing next-steps block in a single write"""
+    sys.stdout.write("\n".join(NEXT_STEPS) + "\n")
+    sys.stdout.flush()
+
+
 def print_response(response_data: Dict[str, Any]):
     """Print a formatted response"""
+    text, sources, metadata, query_type, confidence = RESPONSE_FIELDS(
+        {**RESPONSE_DEFAULTS, **response_data}
+    )
+    
     print(f"\n🤖 TransactBot Response:")
-    print(f"   {response_data.get('response', 'No response')}")
+    print(f"   {text}")
     
-    sources = response_data.get('sources', [])
     if sources:
         print(f"\n📊 Sources Found: {len(sources)}")
         for i, source in enumerate(sources[:3], 1):  # Show max 3 sources
             print(f"   {i}. {source.get('title', 'Unknown')}")
     
-    metadata = response_data.get('metadata', {})
     if metadata:
         processing_time = metadata.get('processing_time_seconds', 'Unknown')
         print(f"\n⏱️  Processing Time: {processing_time}s")
     
-    print(f"🎯 Query Type: {response_data.get('query_type', 'Unknown')}")
-    print(f"📈 Confidence: {response_data.get('confidence', 0):.1%}")
+    print(f"🎯 Query Type: {query_type}")
+    print(f"📈 Confidence: {confidence:.1%}")
 
 
-def test_chat_query(query: str) -> Dict[str, Any]:
-    """Test a chat query"""
-    url = f"{BASE_URL}/api/v1/transactions/chat"
-    
-    payload = {
+def build_chat_payload(query: str) -> bytes:
+    """Serialize a chat request body for the test user and session"""
+    return orjson.dumps({
         "query": query,
         "user_id": TEST_USER_ID,
         "session_id": TEST_SESSION_ID,
         "language": "en"
-    }
-    
+    })
+
+
+async def test_chat_query(client: httpx.AsyncClient, payload: bytes) -> Dict[str, Any]:
+    """Test a chat query with a pre-serialized JSON payload"""
     try:
-        print(f"\n💬 Query: '{query}'")
-        print("🔄 Processing...")
-        
-        response = requests.post(url, json=payload, timeout=60)  # Increased timeout for RAG
+        response = await client.post("/api/v1/transactions/chat", content=payload)
         
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
-            print(f"❌ Error {response.status_code}: {response.text}")
-            return {"error": f"HTTP {response.status_code}"}
+            return {"error": f"HTTP {response.status_code}: {response.text}"}
             
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Request failed: {e}")
-        return {"error": str(e)}
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        return {"error": f"Request failed: {e}"}
+
+
+async def run_chat_queries(queries: List[str]) -> List[Dict[str, Any]]:
+    """Run chat queries concurrently, at most MAX_CONCURRENT_QUERIES at a time"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    limits = httpx.Limits(max_connections=8, max_keepalive_connections=8)
+    payloads = [build_chat_payload(query) for query in queries]
+    
+    async with httpx.AsyncClient(
+        base_url=BASE_URL,
+        headers={"Content-Type": "application/json"},
+        timeout=60,  # Generous timeout for RAG
+        limits=limits,
+    ) as client:
+        async def bounded(payload: bytes) -> Dict[str, Any]:
+            async with semaphore:
+                return await test_chat_query(client, payload)
+        
+        return await asyncio.gather(*(bounded(payload) for payload in payloads))
 
 
 def test_bulk_indexing() -> Dict[str, Any]:
@@ -86,15 +150,15 @@ def test_bulk_indexing() -> Dict[str, Any]:
     try:
         print("🔄 Starting bulk indexing...")
         
-        response = requests.post(url, json=payload, timeout=120)
+        response = SESSION.post(url, json=payload, timeout=120)
         
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
             print(f"❌ Indexing error {response.status_code}: {response.text}")
             return {"error": f"HTTP {response.status_code}"}
             
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"❌ Indexing request failed: {e}")
         return {"error": str(e)}
 
@@ -104,15 +168,15 @@ def test_corpus_info() -> Dict[str, Any]:
     url = f"{BASE_URL}/api/v1/transactions/corpus/info"
     
     try:
-        response = requests.get(url, timeout=10)
+        response = SESSION.get(url, timeout=10)
         
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
             print(f"❌ Corpus info error {response.status_code}: {response.text}")
             return {"error": f"HTTP {response.status_code}"}
             
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"❌ Corpus info request failed: {e}")
         return {"error": str(e)}
 
@@ -130,15 +194,15 @@ def test_analytics() -> Dict[str, Any]:
     try:
         print("🔄 Generating analytics...")
         
-        response = requests.post(url, json=payload, timeout=30)
+        response = SESSION.post(url, json=payload, timeout=30)
         
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
             print(f"❌ Analytics error {response.status_code}: {response.text}")
             return {"error": f"HTTP {response.status_code}"}
             
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"❌ Analytics request failed: {e}")
         return {"error": str(e)}
 
@@ -153,7 +217,7 @@ def main():
     # Test 1: Check if API is running
     print_header("1️⃣  API Health Check")
     try:
-        response = requests.get(f"{BASE_URL}/api/v1/health", timeout=5)
+        response = SESSION.get(f"{BASE_URL}/api/v1/health", timeout=5)
         if response.status_code == 200:
             print("✅ API is running and healthy")
         else:
@@ -207,17 +271,17 @@ def main():
         "Compare my spending this month vs last month"
     ]
     
-    for i, query in enumerate(test_queries, 1):
+    print(f"\n🔄 Processing {len(test_queries)} queries concurrently...")
+    results = run_loop(run_chat_queries(test_queries))
+    
+    for i, (query, result) in enumerate(zip(test_queries, results), 1):
         print(f"\n--- Test Query {i}/{len(test_queries)} ---")
-        result = test_chat_query(query)
+        print(f"\n💬 Query: '{query}'")
         
         if "error" not in result:
             print_response(result)
         else:
             print(f"❌ Query failed: {result['error']}")
-        
-        # Small delay between queries
-        time.sleep(1)
     
     # Test 5: Analytics
     print_header("5️⃣  Analytics Test")
@@ -232,14 +296,9 @@ def main():
     # Final summary
     print_header("📋 Test Summary")
     print("✅ Transaction RAG Agent test suite completed!")
-    print("\n🎯 Next Steps:")
-    print("   1. Try more complex queries through the API")
-    print("   2. Integrate with your frontend application")
-    print("   3. Set up automatic transaction indexing")
-    print("   4. Customize prompts and responses for your use case")
-    print("\n📚 Documentation: agents/transaction_rag_agent/README.md")
-    print("🔗 API Docs: http://localhost:8080/docs")
+    print_next_steps()
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    with SESSION:
+        main() 
\ No newline at end of file
@@ -4,9 +4,19 @@ Simple test script for the simplified receipt scanner agent
 Tests the Google SDK integration and category system
 """
 
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
 import os
+import re
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
 
 # Add the project root to Python path
 project_root = Path(__file__).parent
@@ -16,6 +26,48 @@ sys.path.insert(0, str(project_root))
 os.environ["GOOGLE_CLOUD_PROJECT_ID"] = "walleterium"
 os.environ["VERTEX_AI_LOCATION"] = "us-central1"
 os.environ["ENVIRONMENT"] = "development"
+# Keep gRPC's logger quiet when the Vertex AI SDK is first imported
+os.environ.setdefault("GRPC_VERBOSITY", "ERROR")
+
+try:
+    import pytest
+except ImportError:  # Running as a plain script
+    pytest = None
+
+
+def _adc_configured() -> bool:
+    """Whether Application Default Credentials can resolve a real identity"""
+    if os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
+        return True
+    config_dir = os.environ.get("CLOUDSDK_CONFIG")
+    if not config_dir:
+        if os.name == "nt":
+            config_dir = Path(os.environ.get("APPDATA", "")) / "gcloud"
+        else:
+            config_dir = Path.home() / ".config" / "gcloud"
+    return (Path(config_dir) / "application_default_credentials.json").is_file()
+
+
+if pytest is not None:
+
+    @pytest.fixture(autouse=True)
+    def anonymous_adc(monkeypatch):
+        """Opt-in (SKIP_ADC_DISCOVERY=1): skip the slow ADC scan on machines
+        with no credentials configured; never overrides real credentials"""
+        if os.environ.get("SKIP_ADC_DISCOVERY") != "1" or _adc_configured():
+            return
+
+        import google.auth
+        from google.auth.credentials import AnonymousCredentials
+
+        monkeypatch.setattr(
+            google.auth,
+            "default",
+            lambda *args, **kwargs: (
+                AnonymousCredentials(),
+                os.environ["GOOGLE_CLOUD_PROJECT_ID"],
+            ),
+        )
 
 
 def test_categories():
@@ -84,9 +136,16 @@ def test_agent_initialization():
         print(f"   Location: {agent.location}")
         print(f"   Model: {agent.model_name}")
 
-        # Test health check
+        # Test health check; its count_tokens warm-up is a live Vertex AI call,
+        # so this also fails when the endpoint is unreachable
         health = agent.health_check()
         print(f"✅ Health check: {health['status']}")
+        if health["warm"] is not True:
+            print(
+                "❌ Agent built, but the model endpoint is unreachable "
+                f"(count_tokens failed): {health.get('error', 'unknown')}"
+            )
+            return False
 
         return True
     except Exception as e:
@@ -99,20 +158,23 @@ def test_prompt_generation():
     print("\n🧪 Testing prompt generation...")
 
     try:
-        from agents.receipt_scanner.prompts import create_agentic_prompt
+        from agents.receipt_scanner.prompts import create_simplified_prompt
 
         # Test image prompt
-        image_prompt = create_agentic_prompt("image")
+        image_prompt = create_simplified_prompt("image")
         print(f"✅ Image prompt generated ({len(image_prompt)} characters)")
 
         # Test video prompt
-        video_prompt = create_agentic_prompt("video")
+        video_prompt = create_simplified_prompt("video")
         print(f"✅ Video prompt generated ({len(video_prompt)} characters)")
 
         # Verify categories are in prompt
         from config.constants import TRANSACTION_CATEGORIES
 
-        category_found = any(cat in image_prompt for cat in TRANSACTION_CATEGORIES[:5])
+        category_pattern = re.compile(
+            "|".join(re.escape(category) for category in TRANSACTION_CATEGORIES[:5])
+        )
+        category_found = category_pattern.search(image_prompt) is not None
         if category_found:
             print("✅ Categories properly included in prompt")
         else:
@@ -124,15 +186,24 @@ def test_prompt_generation():
         return False
 
 
+@functools.lru_cache(maxsize=1)
+def _load_font():
+    """Load the default font once, only when a test image is rendered"""
+    from PIL import ImageFont
+
+    return ImageFont.load_default()
+
+
+@functools.lru_cache(maxsize=1)
 def create_test_image():
-    """Create a simple test image for testing"""
+    """Create a simple test image for testing (rendered once per process)"""
     try:
         from PIL import Image, ImageDraw
-        import io
 
         # Create a simple receipt-like image
         img = Image.new("RGB", (400, 600), color="white")
         draw = ImageDraw.Draw(img)
+        font = _load_font()
 
         # Add some text that looks like a receipt
         receipt_text = [
@@ -154,14 +225,23 @@ def create_test_image():
             "Thank you!",
         ]
 
-        y = 50
-        for line in receipt_text:
-            draw.text((50, y), line, fill="black")
-            y += 25
+        # Draw every line in one call, keeping the 25px line pitch
+        spacing = 25 - draw.textbbox((0, 0), "A", font=font)[3]
+        draw.multiline_text(
+            (50, 50), "\n".join(receipt_text), fill="black", font=font, spacing=spacing
+        )
 
-        # Convert to bytes
+        # Convert to bytes; quality barely matters for a synthetic input, so
+        # favour a fast encode and a small upload (baseline, 4:2:0 chroma)
         buffer = io.BytesIO()
-        img.save(buffer, format="JPEG")
+        img.save(
+            buffer,
+            format="JPEG",
+            quality=60,
+            subsampling=2,
+            optimize=False,
+            progressive=False,
+        )
         return buffer.getvalue()
 
     except Exception as e:
@@ -196,6 +276,7 @@ def test_full_analysis():
             print(f"   Category: {data['category']}")
             print(f"   Items: {len(data['items'])}")
             print(f"   Processing time: {result['processing_time']:.1f}s")
+            print(f"   First chunk after: {result['first_chunk_latency']:.1f}s")
 
             if result.get("validation", {}).get("is_valid"):
                 print("✅ Validation passed")
@@ -212,7 +293,186 @@ def test_full_analysis():
         return False
 
 
-def main():
+class _FakeChunk:
+    """Stands in for a streamed Gemini response chunk"""
+
+    def __init__(self, text=None):
+        self._text = text
+        parts = [text] if text is not None else []
+        self.candidates = [SimpleNamespace(content=SimpleNamespace(parts=parts))]
+
+    @property
+    def text(self):
+        if self._text is None:  # The SDK raises on chunks without text parts
+            raise ValueError("chunk has no text")
+        return self._text
+
+
+def test_streamed_analysis():
+    """Test that streamed chunks are joined and timed (offline, fake model)"""
+    print("\n🧪 Testing streamed response handling...")
+
+    try:
+        from agents.receipt_scanner.agent import SimplifiedReceiptAgent
+
+        # Bypass __init__ so no Vertex AI model is created
+        agent = SimplifiedReceiptAgent.__new__(SimplifiedReceiptAgent)
+        agent.model_name = "fake-model"
+        agent._prepare_media = lambda media_bytes, media_type: (
+            media_bytes,
+            "image/jpeg",
+        )
+        chunks = [
+            _FakeChunk('{"place": "Sample Store", '),
+            _FakeChunk('"amount": 14.57}'),
+            _FakeChunk(),  # Trailing chunk with only usage metadata
+        ]
+        agent.model = SimpleNamespace(
+            generate_content=lambda contents, stream=False: iter(chunks)
+        )
+
+        result = agent.analyze_receipt(b"fake", "image", "test_user")
+
+        if result["status"] != "success":
+            print(f"❌ Streamed analysis failed: {result}")
+            return False
+        data = result["data"]
+        if (data.get("place"), data.get("amount")) != ("Sample Store", 14.57):
+            print(f"❌ Streamed chunks were not joined correctly: {data}")
+            return False
+        if result["first_chunk_latency"] is None:
+            print("❌ First chunk latency was not recorded")
+            return False
+
+        print("✅ Streamed chunks joined and first-chunk latency recorded")
+        return True
+
+    except Exception as e:
+        print(f"❌ Streamed analysis test failed: {e}")
+        return False
+
+
+def test_full_analysis_batch(batch_size: int = 4):
+    """Test batched analysis of several images in a single Gemini call"""
+    print("\n🧪 Testing batched receipt analysis...")
+
+    try:
+        test_image = create_test_image()
+        if not test_image:
+            print("⚠️ Skipping batch analysis test (no test image)")
+            return True
+
+        from agents.receipt_scanner.agent import get_receipt_scanner_agent
+
+        agent = get_receipt_scanner_agent()
+
+        print(f"📸 Running batch analysis on {batch_size} test images...")
+        result = agent.analyze_receipts_batch([test_image] * batch_size, "test_user")
+
+        if result["status"] == "success":
+            results = result["data"]
+            if len(results) != batch_size:
+                print(f"❌ Expected {batch_size} results, got {len(results)}")
+                return False
+
+            print(f"✅ Batch analysis successful! {len(results)} receipts")
+            for i, data in enumerate(results, 1):
+                print(f"   {i}. {data['place']}: ${data['amount']}")
+            print(f"   Processing time: {result['processing_time']:.1f}s")
+            return True
+        else:
+            print(f"❌ Batch analysis failed: {result}")
+            return False
+
+    except Exception as e:
+        print(f"❌ Batch analysis test failed: {e}")
+        return False
+
+
+class _ThreadOutput(io.TextIOBase):
+    """sys.stdout stand-in that sends each worker thread's prints to its own buffer"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def _timed(test):
+    """Run one test, treating a crash as a failure; returns (result, elapsed ns)"""
+    start_ns = time.perf_counter_ns()
+    try:
+        result = test()
+    except Exception as e:
+        print(f"❌ Test {test.__name__} crashed: {e}")
+        result = False
+    return result, time.perf_counter_ns() - start_ns
+
+
+def _run_captured(test, output):
+    """Run one test on a worker thread and collect what it prints"""
+    output.local.buffer = buffer = io.StringIO()
+    try:
+        result, elapsed_ns = _timed(test)
+    finally:
+        output.local.buffer = None
+    return result, buffer.getvalue(), elapsed_ns
+
+
+async def run_all(tests):
+    """Run the (blocking) tests concurrently on worker threads
+
+    test_agent_initialization runs on its own first, so its health check warms
+    the shared agent's connection before the analysis tests start.
+    """
+    output = _ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        outcomes = {}
+        if test_agent_initialization in tests:
+            outcomes[test_agent_initialization] = await asyncio.to_thread(
+                _run_captured, test_agent_initialization, output
+            )
+        rest = [test for test in tests if test not in outcomes]
+        outcomes.update(
+            zip(
+                rest,
+                await asyncio.gather(
+                    *(asyncio.to_thread(_run_captured, test, output) for test in rest)
+                ),
+            )
+        )
+        return [outcomes[test] for test in tests]
+    finally:
+        sys.stdout = output.stream
+
+
+def _init_worker():
+    """Build the agent once per worker process so its tests share it"""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            from agents.receipt_scanner.agent import get_receipt_scanner_agent
+
+            get_receipt_scanner_agent()
+    except Exception:
+        pass  # test_agent_initialization reports the failure
+
+
+def _run_test_name(name):
+    """Run a test by name in a worker process and collect what it prints"""
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        result, elapsed_ns = _timed(globals()[name])
+    return result, buffer.getvalue(), elapsed_ns
+
+
+def main(workers: int = 0):
     """Run all tests"""
     print("🚀 Testing Simplified Receipt Scanner Agent")
     print("=" * 50)
@@ -222,17 +482,25 @@ def main():
         test_schema,
         test_agent_initialization,
         test_prompt_generation,
+        test_streamed_analysis,
         test_full_analysis,
+        test_full_analysis_batch,
     ]
 
-    results = []
-    for test in tests:
-        try:
-            result = test()
-            results.append(result)
-        except Exception as e:
-            print(f"❌ Test {test.__name__} crashed: {e}")
-            results.append(False)
+    # Run the tests concurrently, then replay each one's output in order
+    if workers > 0:
+        # Separate processes, for CPU-bound image prep and response parsing
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker
+        ) as executor:
+            outcomes = list(
+                executor.map(_run_test_name, [test.__name__ for test in tests])
+            )
+    else:
+        outcomes = asyncio.run(run_all(tests))
+
+    results, outputs, timings_ns = zip(*outcomes)
+    sys.stdout.write("".join(outputs))
 
     print("\n" + "=" * 50)
     print("🎯 Test Results:")
@@ -240,9 +508,15 @@ def main():
     passed = sum(results)
     total = len(results)
 
-    for i, (test, result) in enumerate(zip(tests, results)):
-        status = "✅ PASS" if result else "❌ FAIL"
-        print(f"   {i+1}. {test.__name__}: {status}")
+    print(
+        "\n".join(
+            f"   {i}. {test.__name__}: {'✅ PASS' if result else '❌ FAIL'} "
+            f"({elapsed_ns / 1e9:.2f}s)"
+            for i, (test, result, elapsed_ns) in enumerate(
+                zip(tests, results, timings_ns), 1
+            )
+        )
+    )
 
     print(f"\nOverall: {passed}/{total} tests passed")
 
@@ -257,5 +531,14 @@ def main():
 
 
 if __name__ == "__main__":
-    success = main()
+    parser = argparse.ArgumentParser(description="Test the simplified receipt agent")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="run tests in N worker processes (default: threads in this process)",
+    )
+    args = parser.parse_args()
+
+    success = main(args.workers)
     sys.exit(0 if success else 1)